@@ -1,32 +1,82 @@
+import io
 import sys
 import os
+import mmap
 import zlib
 import time
+import ctypes
+import shutil
+import queue
 import struct
 import hashlib
+import tempfile
+import itertools
+import threading
 import urllib.request
-from typing import List, Tuple, Dict
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import BinaryIO, Callable, Hashable, Iterable, Iterator, List, Tuple, Dict, NamedTuple
 from urllib.parse import urlparse
 
 
-def hash_object(data: bytes, obj_type: str) -> str:
+def hash_object(data: bytes, obj_type: str, git_dir: str = ".git", write: bool = True) -> str:
     """
     Hash an object and store it in the objects directory.
     Returns the SHA1 hash of the object.
     """
-    # Prepare the object store data with header
-    store = f"{obj_type} {len(data)}\x00".encode() + data
+    if not write:
+        return hashlib.sha1(f"{obj_type} {len(data)}\x00".encode() + data).hexdigest()
+    return open_store(git_dir).write(data, obj_type)
 
-    # Calculate SHA1 hash
-    sha = hashlib.sha1(store).hexdigest()
 
-    # Store the object
-    path = f".git/objects/{sha[:2]}"
-    os.makedirs(path, exist_ok=True)
-    with open(f"{path}/{sha[2:]}", "wb") as f:
-        f.write(zlib.compress(store))
+def hash_file(path: str, git_dir: str = ".git", write: bool = True) -> str:
+    """
+    Hash a file as a blob, storing it when write is set. Returns the SHA1 hash.
+    The file is read in fixed-size chunks either way, so memory use does not
+    depend on its size.
+    """
+    if write:
+        return open_store(git_dir).write_file(path)
+
+    size = os.stat(path).st_size
+    sha = hashlib.sha1(f"blob {size}\x00".encode())
+    hashed = 0
+    with open(path, "rb") as f:
+        while chunk := f.read(STREAM_CHUNK_SIZE):
+            sha.update(chunk)
+            hashed += len(chunk)
+    if hashed != size:
+        raise RuntimeError(f"{path} changed while it was being hashed")
+    return sha.hexdigest()
+
+
+def hash_paths(paths: Iterable[str], git_dir: str = ".git", write: bool = True, threads: int = 1) -> Iterator[str]:
+    """
+    Hash many files on a thread pool, yielding their SHA1 hashes in input order.
+    zlib and hashlib release the GIL on large buffers, so compression overlaps
+    with reading the next files.
+    Paths are consumed by a feeder thread into a bounded window of futures, so
+    each hash is yielded as soon as it and those before it are done, without
+    waiting for more paths to arrive.
+    """
+    window: queue.Queue = queue.Queue(maxsize=threads * 4)
+
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        def feed() -> None:
+            try:
+                for path in paths:
+                    window.put(executor.submit(hash_file, path, git_dir, write))
+            except BaseException as e:
+                window.put(e)
+            else:
+                window.put(None)
 
-    return sha
+        threading.Thread(target=feed, daemon=True).start()
+        while (item := window.get()) is not None:
+            if isinstance(item, BaseException):
+                raise item
+            yield item.result()
 
 
 def create_tree_entry(mode: str, name: str, sha: str) -> bytes:
@@ -110,6 +160,84 @@ def create_commit(tree_sha: str, parent_sha: str, message: str) -> str:
     return hash_object(commit_data, "commit")
 
 
+@contextmanager
+def map_file(f: BinaryIO) -> Iterator[mmap.mmap]:
+    """
+    Map an open file read-only for the duration of a block. If the block fails,
+    the traceback may still hold views of the mapping, so it is not closed then
+    and goes away with them instead, letting the original error propagate.
+    """
+    mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    yield mapping
+    mapping.close()
+
+
+def parse_pack_options(args: List[str]) -> Tuple[Dict[str, bool | int | None], List[str]]:
+    """
+    Split pack ingest options off a command line.
+    Returns write_packfile keyword arguments and the remaining arguments.
+    """
+    i, options, rest = 0, {"keep_pack": False, "threads": 1, "processes": 1, "max_memory": None}, []
+    while i < len(args):
+        if args[i] == "--keep-pack":
+            options["keep_pack"] = True
+            i += 1
+        elif args[i] == "--threads":
+            options["threads"] = int(args[i + 1])
+            i += 2
+        elif args[i] == "--processes":
+            options["processes"] = int(args[i + 1])
+            i += 2
+        elif args[i] == "--max-memory":
+            options["max_memory"] = parse_size(args[i + 1])
+            i += 2
+        else:
+            rest.append(args[i])
+            i += 1
+    return options, rest
+
+
+def parse_hash_object_options(args: List[str]) -> Tuple[Dict[str, bool | int], List[str]]:
+    """
+    Split hash-object options off a command line, in any order.
+    Returns the options and the paths of the files to hash.
+    """
+    i, options, paths = 0, {"write": False, "stdin": False, "stdin_paths": False, "threads": 1}, []
+    while i < len(args):
+        if args[i] == "-w":
+            options["write"] = True
+            i += 1
+        elif args[i] == "--stdin":
+            options["stdin"] = True
+            i += 1
+        elif args[i] == "--stdin-paths":
+            options["stdin_paths"] = True
+            i += 1
+        elif args[i] == "--threads":
+            options["threads"] = int(args[i + 1])
+            i += 2
+        elif args[i] == "--":
+            paths.extend(args[i + 1:])
+            break
+        elif args[i].startswith("-"):
+            raise RuntimeError(f"Unknown hash-object option: {args[i]}")
+        else:
+            paths.append(args[i])
+            i += 1
+
+    if "--threads" in args[:i] and not options["stdin_paths"]:
+        raise RuntimeError("hash-object: --threads only applies to --stdin-paths")
+    return options, paths
+
+
+def parse_size(value: str) -> int:
+    """Parse a byte count with an optional k, m or g suffix, as in git config."""
+    units = {"k": 1 << 10, "m": 1 << 20, "g": 1 << 30}
+    if value[-1:].lower() in units:
+        return int(value[:-1]) * units[value[-1].lower()]
+    return int(value)
+
+
 def convert_github_url(url: str) -> str:
     """Convert a GitHub URL to a Git URL."""
     parsed = urlparse(url)
@@ -149,13 +277,13 @@ def get_refs(url: str) -> Tuple[Dict[str, bool | str], List[Tuple[str, str]]]:
     return caps, refs
 
 
-def download_packfile(url: str, want_ref: str) -> bytes:
-    """Download a packfile using Git protocol v2."""
+def stream_packfile(url: str, want_ref: str, out: BinaryIO) -> None:
+    """Download a packfile using Git protocol v2, writing the pack data to out as it arrives."""
     url = f"{url}/git-upload-pack"
 
     # Create the request body with proper packet format
     body = (
-            b"0011command=fetch0001000fno-progress"
+            b"0011command=fetch0001000fno-progress000dofs-delta"
             + f"0032want {want_ref}\n".encode()
             + b"0009done\n0000"
     )
@@ -167,194 +295,1527 @@ def download_packfile(url: str, want_ref: str) -> bytes:
 
     req = urllib.request.Request(url, data=body, headers=headers)
     with urllib.request.urlopen(req) as response:
-        data = response.read()
+        # Skip the section header line, then demultiplex the sideband lines
+        header = True
+        while True:
+            # Read packet length (4 hex digits)
+            line_len = response.read(4)
+            if not line_len or int(line_len, 16) == 0:
+                break
+            line = response.read(int(line_len, 16) - 4)
+            if header:
+                header = False
+            elif line[0] == 1:  # Pack data
+                out.write(line[1:])
+            elif line[0] == 3:  # Fatal error
+                raise RuntimeError(f"Remote error: {line[1:].decode().strip()}")
 
-    # Parse the response into lines
-    pack_lines = []
 
-    while data:
-        # Read packet length (4 hex digits)
-        line_len = int(data[:4], 16)
-        if line_len == 0:
-            break
-        pack_lines.append(data[4:line_len])
-        data = data[line_len:]
+def download_packfile(url: str, want_ref: str) -> bytes:
+    """Download a packfile using Git protocol v2."""
+    out = io.BytesIO()
+    stream_packfile(url, want_ref, out)
+    return out.getvalue()
 
-    # Combine all lines after the first one (skipping header)
-    # and remove the packet type byte from each line
-    return b"".join(l[1:] for l in pack_lines[1:])
 
+PACK_OBJECT_TYPES = {
+    1: "commit",
+    2: "tree",
+    3: "blob",
+    4: "tag",
+    6: "ofs_delta",
+    7: "ref_delta"
+}
 
-def write_packfile(data: bytes, target_dir: str) -> None:
-    """Parse and write a packfile to the target directory."""
-    git_dir = os.path.join(target_dir, ".git")
+# Largest slice of compressed data handed to zlib in one call
+INFLATE_CHUNK_SIZE = 1 << 20
 
-    def next_size_type(bs: bytes) -> Tuple[str, int, bytes]:
-        """Parse the type and size of the next object."""
-        ty = (bs[0] & 0b01110000) >> 4
-        type_map = {
-            1: "commit",
-            2: "tree",
-            3: "blob",
-            4: "tag",
-            6: "ofs_delta",
-            7: "ref_delta"
-        }
-        ty = type_map.get(ty, "unknown")
-
-        size = bs[0] & 0b00001111
-        i = 1
-        shift = 4
-        while bs[i - 1] & 0b10000000:
-            size |= (bs[i] & 0b01111111) << shift
-            shift += 7
-            i += 1
-        return ty, size, bs[i:]
-
-    def next_size(bs: bytes) -> Tuple[int, bytes]:
-        """Parse just the size field."""
-        size = bs[0] & 0b01111111
-        i = 1
-        shift = 7
-        while bs[i - 1] & 0b10000000:
-            size |= (bs[i] & 0b01111111) << shift
-            shift += 7
-            i += 1
-        return size, bs[i:]
+# Bytes of a file hashed and compressed at a time when streaming it into the store
+STREAM_CHUNK_SIZE = 1 << 20
 
-    # Skip pack header and version (8 bytes)
-    data = data[8:]
+# Compressed bytes fed to zlib at a time when only an object header is needed
+HEADER_CHUNK_SIZE = 64
 
-    # Read number of objects
-    n_objects = struct.unpack("!I", data[:4])[0]
-    data = data[4:]
+# Number of non-delta objects each ingest thread stores per task
+ROOT_BATCH_SIZE = 256
 
-    print(f"Processing {n_objects} objects")
+# Default memory budget for resolved delta bases, matching git's core.deltaBaseCacheLimit
+DELTA_BASE_CACHE_LIMIT = 96 * 1024 * 1024
+
+# Default memory budgets of the object cache in front of object reads
+OBJECT_CACHE_TREE_LIMIT = 32 * 1024 * 1024
+OBJECT_CACHE_BLOB_LIMIT = 64 * 1024 * 1024
+
+# Uncompressed bytes of objects queued in the background writer before producers block
+WRITER_MEMORY_LIMIT = 64 * 1024 * 1024
+
+# Compressor threads of the background writer
+WRITER_COMPRESSORS = 2
+
+
+def read_type_size(buf: memoryview, offset: int) -> Tuple[str, int, int]:
+    """
+    Parse the type and size header of the pack entry at offset.
+    Returns the type, the inflated size and the offset just past the header.
+    """
+    byte = buf[offset]
+    ty = PACK_OBJECT_TYPES.get((byte & 0b01110000) >> 4, "unknown")
+    size = byte & 0b00001111
+    shift = 4
+    offset += 1
+    while byte & 0b10000000:
+        byte = buf[offset]
+        size |= (byte & 0b01111111) << shift
+        shift += 7
+        offset += 1
+    return ty, size, offset
+
+
+def encode_type_size(obj_type: str, size: int) -> bytes:
+    """Encode the type and size header of a pack entry."""
+    type_num = next(num for num, name in PACK_OBJECT_TYPES.items() if name == obj_type)
+    byte = (type_num << 4) | (size & 0b00001111)
+    size >>= 4
+    out = bytearray()
+    while size:
+        out.append(byte | 0b10000000)
+        byte = size & 0b01111111
+        size >>= 7
+    out.append(byte)
+    return bytes(out)
+
+
+def read_size(buf: bytes | memoryview, offset: int) -> Tuple[int, int]:
+    """Parse a delta size field. Returns the size and the offset just past it."""
+    size = 0
+    shift = 0
+    while True:
+        byte = buf[offset]
+        size |= (byte & 0b01111111) << shift
+        shift += 7
+        offset += 1
+        if not byte & 0b10000000:
+            return size, offset
+
+
+def read_entry_header(buf: memoryview, offset: int) -> Tuple[str, int, str | int | None, int]:
+    """
+    Parse the full header of the pack entry at offset.
+    Returns the type, the inflated size, the base (SHA of a ref_delta, pack offset
+    of an ofs_delta, None otherwise) and the offset of the zlib stream.
+    """
+    obj_type, size, pos = read_type_size(buf, offset)
+
+    base = None
+    if obj_type == "ref_delta":
+        # Reference delta object - its base is identified by SHA
+        base = buf[pos:pos + 20].hex()
+        pos += 20
+    elif obj_type == "ofs_delta":
+        # Offset delta object - its base is identified by pack offset
+        distance, pos = read_ofs_distance(buf, pos)
+        base = offset - distance
+    elif obj_type not in ["commit", "tree", "blob", "tag"]:
+        raise RuntimeError(f"Unsupported pack object type {obj_type} at offset {offset}")
+
+    return obj_type, size, base, pos
 
-    # First pass: collect all objects and their data
-    objects = []  # List to store (type, content, base_sha) tuples
-    remaining_data = data
 
+def read_ofs_distance(buf: memoryview, offset: int) -> Tuple[int, int]:
+    """
+    Parse the base distance of an ofs_delta entry.
+    Returns how far before the entry its base starts and the offset just past the field.
+    """
+    byte = buf[offset]
+    distance = byte & 0b01111111
+    offset += 1
+    while byte & 0b10000000:
+        byte = buf[offset]
+        distance = ((distance + 1) << 7) | (byte & 0b01111111)
+        offset += 1
+    return distance, offset
+
+
+def inflate_prefix(buf: bytes | memoryview, offset: int, length: int) -> bytes:
+    """
+    Inflate at most length bytes from the start of the zlib stream at offset,
+    feeding zlib small slices so only the first few dozen bytes are decompressed.
+    """
+    decomp = zlib.decompressobj()
+    out = b""
+    pos = offset
+    while len(out) < length and not decomp.eof:
+        if decomp.unconsumed_tail:
+            data = decomp.unconsumed_tail
+        else:
+            data = buf[pos:pos + HEADER_CHUNK_SIZE]
+            pos += len(data)
+            if not data:
+                break
+        out += decomp.decompress(data, length - len(out))
+    return out
+
+
+def inflate_chunks(read: Callable[[int], bytes]) -> Iterator[bytes]:
+    """
+    Inflate a zlib stream pulled through read(n), yielding at most
+    STREAM_CHUNK_SIZE bytes at a time however well the data compresses.
+    """
+    decomp = zlib.decompressobj()
+    while not decomp.eof:
+        data = decomp.unconsumed_tail or read(STREAM_CHUNK_SIZE)
+        if not data:
+            # Input is exhausted, so only output zlib still holds can remain
+            rest = decomp.flush()
+            if not decomp.eof:
+                raise RuntimeError("Truncated zlib stream")
+            if rest:
+                yield rest
+            return
+        chunk = decomp.decompress(data, STREAM_CHUNK_SIZE)
+        if chunk:
+            yield chunk
+
+
+def inflate_at(buf: memoryview, offset: int, size: int) -> Tuple[bytes, int]:
+    """
+    Inflate the zlib stream starting at offset, feeding zlib bounded slices of the
+    buffer so the rest of the pack is never copied.
+    Returns the content and the offset just past the compressed stream.
+    """
+    decomp = zlib.decompressobj()
+    parts = []
+    pos = offset
+    # Compressed data is rarely larger than the inflated size plus zlib framing,
+    # so the first slice usually covers the whole stream
+    step = min(size + 64, INFLATE_CHUNK_SIZE)
+    while not decomp.eof:
+        chunk = buf[pos:pos + step]
+        if not chunk:
+            raise RuntimeError(f"Truncated pack entry at offset {offset}")
+        parts.append(decomp.decompress(chunk))
+        pos += len(chunk)
+    pos -= len(decomp.unused_data)
+
+    content = b"".join(parts)
+    if len(content) != size:
+        raise RuntimeError(f"Pack entry at offset {offset} inflated to {len(content)} bytes, expected {size}")
+    return content, pos
+
+
+def apply_delta(base_content: bytes, delta: bytes) -> bytearray:
+    """
+    Apply a git delta instruction stream to its base content.
+    The target is preallocated from the size declared in the delta header and
+    filled through memoryview slices while the instructions are walked by index.
+    """
+    base_size, pos = read_size(delta, 0)
+    target_size, pos = read_size(delta, pos)
+    if base_size != len(base_content):
+        raise RuntimeError(f"Delta expects a {base_size} byte base, got {len(base_content)}")
+
+    result = bytearray(target_size)
+    out = memoryview(result)
+    base = memoryview(base_content)
+    insert = memoryview(delta)
+    written = 0
+    end = len(delta)
+
+    while pos < end:
+        cmd = delta[pos]
+        pos += 1
+        if cmd & 0b10000000:  # Copy command
+            # Offset and size bytes are only present when their bit is set
+            offset = 0
+            if cmd & 0b00000001:
+                offset = delta[pos]
+                pos += 1
+            if cmd & 0b00000010:
+                offset |= delta[pos] << 8
+                pos += 1
+            if cmd & 0b00000100:
+                offset |= delta[pos] << 16
+                pos += 1
+            if cmd & 0b00001000:
+                offset |= delta[pos] << 24
+                pos += 1
+
+            size = 0
+            if cmd & 0b00010000:
+                size = delta[pos]
+                pos += 1
+            if cmd & 0b00100000:
+                size |= delta[pos] << 8
+                pos += 1
+            if cmd & 0b01000000:
+                size |= delta[pos] << 16
+                pos += 1
+            if size == 0:
+                size = 0x10000
+
+            if offset + size > base_size or written + size > target_size:
+                raise RuntimeError("Delta copy instruction out of bounds")
+            out[written:written + size] = base[offset:offset + size]
+            written += size
+
+        elif cmd:  # Insert command
+            if pos + cmd > end or written + cmd > target_size:
+                raise RuntimeError("Delta insert instruction out of bounds")
+            out[written:written + cmd] = insert[pos:pos + cmd]
+            pos += cmd
+            written += cmd
+
+        else:
+            raise RuntimeError("Invalid delta instruction 0")
+
+    if written != target_size:
+        raise RuntimeError(f"Delta produced {written} bytes, expected {target_size}")
+    return result
+
+
+def write_pack_index(pack_dir: str, data: bytes, entries: List[Tuple[str, int, int]]) -> str:
+    """
+    Store a pack verbatim in pack_dir next to a version 2 .idx built from
+    (sha, offset, crc32) entries. Returns the pack checksum used to name both files.
+    """
+    pack_sha = bytes(data[-20:])
+    entries = sorted(entries)
+
+    # Fanout table: number of objects whose first SHA byte is <= i
+    fanout = [0] * 256
+    for sha, _, _ in entries:
+        fanout[int(sha[:2], 16)] += 1
+    for i in range(1, 256):
+        fanout[i] += fanout[i - 1]
+
+    # Offsets that do not fit in 31 bits go to a separate 8-byte table
+    small_offsets, large_offsets = [], []
+    for _, offset, _ in entries:
+        if offset < 0x80000000:
+            small_offsets.append(offset)
+        else:
+            small_offsets.append(0x80000000 | len(large_offsets))
+            large_offsets.append(offset)
+
+    idx = b"".join([
+        b"\377tOc",
+        struct.pack("!I", 2),
+        struct.pack("!256I", *fanout),
+        b"".join(bytes.fromhex(sha) for sha, _, _ in entries),
+        struct.pack(f"!{len(entries)}I", *(crc for _, _, crc in entries)),
+        struct.pack(f"!{len(entries)}I", *small_offsets),
+        struct.pack(f"!{len(large_offsets)}Q", *large_offsets),
+        pack_sha,
+    ])
+    idx += hashlib.sha1(idx).digest()
+
+    # Write the pack before its index, so a visible .idx always has its pack.
+    # Both go through temporary files, so readers never see a partial file.
+    # A pack with this checksum already in place, possibly the one being
+    # indexed, has these exact bytes and is left alone
+    name = f"pack-{pack_sha.hex()}"
+    os.makedirs(pack_dir, exist_ok=True)
+    files = [("idx", idx)]
+    if not os.path.exists(os.path.join(pack_dir, f"{name}.pack")):
+        files.insert(0, ("pack", data))
+    for suffix, content in files:
+        fd, tmp_path = tempfile.mkstemp(prefix=f"tmp_{suffix}_", dir=pack_dir)
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(content)
+            os.chmod(tmp_path, 0o444)
+            os.replace(tmp_path, os.path.join(pack_dir, f"{name}.{suffix}"))
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+
+    return pack_sha.hex()
+
+
+class PackEntry(NamedTuple):
+    """An object found while parsing a pack."""
+    obj_type: str
+    content: bytes | None  # inflated data, None once released
+    base: str | int | None  # base SHA of a ref_delta, base offset of an ofs_delta
+    offset: int  # offset of the entry header
+    data_offset: int  # offset of the entry's zlib stream
+    size: int  # inflated size
+    crc: int  # CRC32 of the whole entry
+
+
+# State of a delta resolution worker process, set up by init_delta_worker
+_delta_worker = {}
+
+
+def init_delta_worker(pack_path: str, git_dir: str, keep_pack: bool, objects: List[PackEntry],
+                      ofs_children: Dict[int, List[int]], ref_children: Dict[str, List[int]],
+                      batch: bool) -> None:
+    """
+    Map the pack into a worker process and keep the delta graph around.
+    With batch, objects are left in temporary files for the parent to add to its
+    bulk checkin.
+    """
+    # A forked worker inherits the parent's object stores, along with any batch
+    # or background writer that only the parent can drain, so it starts afresh.
+    # Closing the inherited descriptors leaves the parent's own untouched
+    close_stores()
+    if batch:
+        open_store(git_dir).loose.batch = []
+    with open(pack_path, "rb") as f:
+        pack = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    _delta_worker.update(
+        buf=memoryview(pack),
+        git_dir=git_dir,
+        keep_pack=keep_pack,
+        objects=objects,
+        ofs_children=ofs_children,
+        ref_children=ref_children,
+    )
+
+
+def resolve_delta_chain(root: Tuple[int, str, str]) -> Tuple[List[Tuple[int, str]], List[Tuple[str, str]]]:
+    """
+    Resolve every delta descending from one base object, inside a worker process.
+    Deltas are inflated straight from the mapped pack and written by the worker,
+    so only (index, sha) pairs travel back to the parent, along with the
+    (temporary file name, sha) pairs of objects still waiting for the batch.
+    """
+    root_index, obj_type, root_sha = root
+    buf, objects = _delta_worker["buf"], _delta_worker["objects"]
+    ofs_children, ref_children = _delta_worker["ofs_children"], _delta_worker["ref_children"]
+
+    content, _ = inflate_at(buf, objects[root_index].data_offset, objects[root_index].size)
+    resolved = []
+    queue = deque([(root_index, root_sha, content)])
+    while queue:
+        i, sha, content = queue.popleft()
+        for j in ofs_children.get(objects[i].offset, []) + ref_children.get(sha, []):
+            delta, _ = inflate_at(buf, objects[j].data_offset, objects[j].size)
+            result = apply_delta(content, delta)
+            child_sha = hash_object(result, obj_type, _delta_worker["git_dir"], write=not _delta_worker["keep_pack"])
+            resolved.append((j, child_sha))
+            queue.append((j, child_sha, result))
+
+    loose = open_store(_delta_worker["git_dir"]).loose
+    pending = [(tmp_name, sha) for _, tmp_name, sha in loose.batch or []]
+    if loose.batch is not None:
+        loose.batch = []
+    return resolved, pending
+
+
+def resolve_deltas_in_processes(data: bytes, pack_path: str | None, git_dir: str, keep_pack: bool,
+                                objects: List[PackEntry], shas: List[str | None],
+                                ofs_children: Dict[int, List[int]], ref_children: Dict[str, List[int]],
+                                processes: int) -> None:
+    """
+    Resolve independent delta chains, one per base object, on a process pool.
+    Every worker maps the pack from pack_path, or from a temporary copy when
+    data is not backed by a file, so the pack bytes are never pickled; only the
+    chain roots are sent to the workers.
+    """
+    spooled = pack_path is None
+    if spooled:
+        fd, pack_path = tempfile.mkstemp(prefix="tmp_pack_", dir=os.path.join(git_dir, "objects"))
+    try:
+        if spooled:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+
+        roots = [
+            (i, entry.obj_type, shas[i]) for i, entry in enumerate(objects)
+            if entry.base is None and (entry.offset in ofs_children or shas[i] in ref_children)
+        ]
+        layout = [entry._replace(content=None) for entry in objects]
+        # Objects written by the workers join a bulk checkin of this process
+        loose = open_store(git_dir).loose
+        batch = loose.batch is not None
+
+        with ProcessPoolExecutor(max_workers=processes, initializer=init_delta_worker,
+                                 initargs=(pack_path, git_dir, keep_pack, layout, ofs_children, ref_children,
+                                           batch)) as pool:
+            chunksize = max(1, len(roots) // (processes * 4))
+            for resolved, pending in pool.map(resolve_delta_chain, roots, chunksize=chunksize):
+                for j, sha in resolved:
+                    shas[j] = sha
+                for tmp_name, sha in pending:
+                    loose.install(loose.fanout_fd(sha), tmp_name, sha)
+    finally:
+        if spooled:
+            os.remove(pack_path)
+
+
+def parse_pack_entries(buf: memoryview, keep_bases: bool = True, keep_deltas: bool = True) -> List[PackEntry]:
+    """
+    Walk every entry of a pack, verifying the trailer checksum on the way.
+    Inflated content is kept for non-delta and delta entries as requested;
+    dropped content can be inflated again from the entry's data offset.
+    """
+    # Pack header: signature, version and number of objects (12 bytes)
+    if len(buf) < 32 or buf[:4] != b"PACK":
+        raise RuntimeError("Invalid packfile signature")
+    version, n_objects = struct.unpack_from("!II", buf, 4)
+    if version not in [2, 3]:
+        raise RuntimeError(f"Unsupported pack version {version}")
+    offset = 12
+
+    # The trailer checksum covers everything before it, so it is fed entry by
+    # entry alongside the per-entry CRC32s instead of in a separate pass
+    pack_hash = hashlib.sha1(buf[:offset])
+
+    objects: List[PackEntry] = []
     for _ in range(n_objects):
-        obj_type, _, remaining_data = next_size_type(remaining_data)
+        start = offset
+        obj_type, size, base, data_offset = read_entry_header(buf, offset)
+        content, offset = inflate_at(buf, data_offset, size)
+        if not (keep_bases if base is None else keep_deltas):
+            # Inflated again from the pack when needed
+            content = None
+
+        entry_data = buf[start:offset]
+        pack_hash.update(entry_data)
+        objects.append(PackEntry(obj_type, content, base, start, data_offset, size, zlib.crc32(entry_data)))
+
+    # Check the trailer before anything is used
+    if offset != len(buf) - 20:
+        raise RuntimeError(f"Pack has {len(buf) - 20 - offset} unexpected bytes after {n_objects} objects")
+    if pack_hash.digest() != buf[offset:]:
+        raise RuntimeError("Pack checksum mismatch")
+
+    return objects
+
+
+def write_packfile(data: bytes, target_dir: str, keep_pack: bool = False, threads: int = 1,
+                   processes: int = 1, max_memory: int | None = None, pack_path: str | None = None) -> str | None:
+    """
+    Parse and write a packfile to the target directory.
+    The pack is walked with an integer offset over a single memoryview, so data may
+    be any buffer (bytes, bytearray, mmap) and is never re-sliced per object.
+    With keep_pack, the pack is stored as-is under objects/pack with a .idx
+    instead of being exploded into loose objects.
+    Hashing, compressing and writing of non-delta objects is spread over threads,
+    and delta chains can be resolved on a pool of processes.
+    With max_memory, only the layout of each entry is kept and objects are
+    inflated again from the pack on demand, with delta bases held in a cache
+    bounded by that many bytes.
+    pack_path names the file data was mapped from, if any, so delta worker
+    processes can map it instead of a copy.
+    Returns the checksum of the stored pack with keep_pack, None otherwise.
+    """
+    git_dir = os.path.join(target_dir, ".git")
+    buf = memoryview(data)
 
-        if obj_type in ["commit", "tree", "blob", "tag"]:
-            # Direct object - just decompress
-            decomp = zlib.decompressobj()
-            content = decomp.decompress(remaining_data)
-            remaining_data = decomp.unused_data
-            objects.append((obj_type, content, None))
+    # First pass: collect all objects and their data
+    objects = parse_pack_entries(buf, keep_bases=max_memory is None,
+                                 keep_deltas=max_memory is None and processes <= 1)
+    n_objects = len(objects)
 
-        elif obj_type == "ref_delta":
-            # Reference delta object - store for second pass
-            base_sha = remaining_data[:20].hex()
-            remaining_data = remaining_data[20:]
+    print(f"Processing {n_objects} objects")
 
-            # Decompress delta data
-            decomp = zlib.decompressobj()
-            delta = decomp.decompress(remaining_data)
-            remaining_data = decomp.unused_data
+    # Second pass: hash every base object once, then resolve deltas breadth-first
+    # from those roots through a base -> children dependency graph
+    shas: List[str | None] = [None] * n_objects
+    ofs_children: Dict[int, List[int]] = {}  # base pack offset -> indices of its deltas
+    ref_children: Dict[str, List[int]] = {}  # base SHA -> indices of its deltas
+    roots = []
+
+    for i, entry in enumerate(objects):
+        if entry.obj_type == "ofs_delta":
+            ofs_children.setdefault(entry.base, []).append(i)
+        elif entry.obj_type == "ref_delta":
+            ref_children.setdefault(entry.base, []).append(i)
+        else:
+            roots.append(i)
+
+    def store_roots(batch: List[int]) -> None:
+        for i in batch:
+            content = objects[i].content
+            if content is None:
+                content, _ = inflate_at(buf, objects[i].data_offset, objects[i].size)
+            shas[i] = hash_object(content, objects[i].obj_type, git_dir, write=not keep_pack)
+            if processes > 1:
+                objects[i] = objects[i]._replace(content=None)
+
+    # zlib and hashlib release the GIL on large buffers, so roots are stored in
+    # batches on a thread pool
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        batches = [roots[k:k + ROOT_BATCH_SIZE] for k in range(0, len(roots), ROOT_BATCH_SIZE)]
+        for _ in pool.map(store_roots, batches):
+            pass
+
+    # In memory-bounded mode resolved bases live in the cache, not in objects
+    cache = LRUCache(max_memory) if max_memory is not None else None
+    parents: Dict[int, int] = {}  # delta index -> base index
+
+    def load(i: int) -> bytes:
+        """Get the content of a resolved object, rebuilding it from the pack if needed."""
+        # Walk up the chain to the nearest object whose content is at hand
+        chain = []
+        while True:
+            entry = objects[i]
+            if entry.content is not None:
+                content = entry.content
+                break
+            cached = cache.get((git_dir, entry.offset))
+            if cached is not None:
+                content = cached[1]
+                break
+            if i not in parents:
+                content, _ = inflate_at(buf, entry.data_offset, entry.size)
+                break
+            chain.append(i)
+            i = parents[i]
+
+        # Then apply the deltas back down
+        for j in reversed(chain):
+            delta, _ = inflate_at(buf, objects[j].data_offset, objects[j].size)
+            content = apply_delta(content, delta)
+        return content
+
+    def resolve_from(start: List[int]) -> None:
+        queue = deque(start)
+        while queue:
+            i = queue.popleft()
+            children = ofs_children.pop(objects[i].offset, []) + ref_children.pop(shas[i], [])
+            if children:
+                obj_type, content = objects[i].obj_type, load(i)
+
+                for j in children:
+                    delta = objects[j].content
+                    if delta is None:
+                        delta, _ = inflate_at(buf, objects[j].data_offset, objects[j].size)
+                    result = apply_delta(content, delta)
+                    shas[j] = hash_object(result, obj_type, git_dir, write=not keep_pack)
+
+                    if cache is None:
+                        objects[j] = objects[j]._replace(obj_type=obj_type, content=result)
+                    else:
+                        objects[j] = objects[j]._replace(obj_type=obj_type)
+                        parents[j] = i
+                        if objects[j].offset in ofs_children or shas[j] in ref_children:
+                            cache.put((git_dir, objects[j].offset), obj_type, result)
+                    queue.append(j)
+
+            # All deltas against this object are resolved, so its content can go,
+            # unless it was borrowed from the object store and cannot be re-read from the pack
+            if i < n_objects:
+                objects[i] = objects[i]._replace(content=None)
+
+    if processes > 1:
+        resolve_deltas_in_processes(data, pack_path, git_dir, keep_pack, objects, shas, ofs_children, ref_children,
+                                    processes)
+    else:
+        resolve_from(roots)
+
+    # Thin packs leave out bases the receiver already has. Take the missing ones
+    # from the local object store and resolve what depends on them, like
+    # index-pack --fix-thin
+    missing = {entry.base for i, entry in enumerate(objects) if entry.obj_type == "ref_delta" and shas[i] is None}
+    thin_bases = []
+    for base_sha in sorted(missing):
+        try:
+            obj_type, content = open_store(git_dir).read(base_sha)
+        except RuntimeError:
+            continue
+        thin_bases.append(len(objects))
+        objects.append(PackEntry(obj_type, content, None, -1, -1, len(content), 0))
+        shas.append(base_sha)
+    resolve_from(thin_bases)
+
+    unresolved = shas.count(None)
+    if unresolved:
+        raise RuntimeError(f"{unresolved} deltas have no base in pack")
+
+    if keep_pack:
+        if thin_bases:
+            # Append the borrowed bases so the stored pack is self-contained
+            parts = [buf[:8], struct.pack("!I", len(objects)), buf[12:-20]]
+            offset = len(buf) - 20
+            for i in thin_bases:
+                entry = objects[i]
+                raw = encode_type_size(entry.obj_type, entry.size) + zlib.compress(entry.content)
+                objects[i] = entry._replace(offset=offset, crc=zlib.crc32(raw))
+                parts.append(raw)
+                offset += len(raw)
+            data = b"".join(parts)
+            data += hashlib.sha1(data).digest()
+            print(f"Completed thin pack with {len(thin_bases)} local objects")
+
+        entries = [(shas[i], entry.offset, entry.crc) for i, entry in enumerate(objects)]
+        pack_sha = write_pack_index(os.path.join(git_dir, "objects", "pack"), data, entries)
+        print(f"Stored pack-{pack_sha}.pack")
+        return pack_sha
+
+    return None
+
+
+class PackIndex:
+    """
+    A version 2 pack index mapped into memory. Objects are located through the
+    256-entry fanout table and a binary search over the sorted SHA table.
+    """
 
-            objects.append(("ref_delta", delta, base_sha))
+    def __init__(self, idx_path: str):
+        with open(idx_path, "rb") as f:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.map[:8] != b"\377tOc" + struct.pack("!I", 2):
+            raise RuntimeError(f"Unsupported pack index version: {idx_path}")
+
+        self.fanout = struct.unpack_from("!256I", self.map, 8)
+        self.count = self.fanout[255]
+        self.sha_table = 8 + 256 * 4
+        self.crc_table = self.sha_table + 20 * self.count
+        self.offset_table = self.crc_table + 4 * self.count
+        self.large_offset_table = self.offset_table + 4 * self.count
+
+    def __len__(self) -> int:
+        return self.count
+
+    def sha_at(self, i: int) -> bytes:
+        pos = self.sha_table + 20 * i
+        return self.map[pos:pos + 20]
+
+    def crc_at(self, i: int) -> int:
+        return struct.unpack_from("!I", self.map, self.crc_table + 4 * i)[0]
+
+    def offset_at(self, i: int) -> int:
+        offset = struct.unpack_from("!I", self.map, self.offset_table + 4 * i)[0]
+        if offset & 0x80000000:
+            offset = struct.unpack_from("!Q", self.map, self.large_offset_table + 8 * (offset & 0x7fffffff))[0]
+        return offset
+
+    def find(self, sha: bytes) -> int | None:
+        """Return the pack offset of a binary SHA, or None if the pack lacks it."""
+        # Only SHAs sharing the first byte need to be searched
+        lo = self.fanout[sha[0] - 1] if sha[0] else 0
+        hi = self.fanout[sha[0]]
+        while lo < hi:
+            mid = (lo + hi) // 2
+            candidate = self.sha_at(mid)
+            if candidate == sha:
+                return self.offset_at(mid)
+            if candidate < sha:
+                lo = mid + 1
+            else:
+                hi = mid
+        return None
 
-    # Second pass: process objects in order
-    processed_objects = set()  # Keep track of processed objects
+    def items(self):
+        """Yield (sha, offset) for every object, in SHA order."""
+        for i in range(self.count):
+            yield self.sha_at(i).hex(), self.offset_at(i)
 
-    def process_object(obj_data: Tuple[str, bytes, str | None]) -> None:
-        obj_type, content, base_sha = obj_data
 
-        if obj_type != "ref_delta":
-            # Direct object
-            store = f"{obj_type} {len(content)}\x00".encode() + content
-            sha = hashlib.sha1(store).hexdigest()
+class PackFile:
+    """A pack and its index, both memory-mapped, so lookups open no files."""
 
-            # Write to objects directory
-            path = os.path.join(git_dir, "objects", sha[:2])
-            os.makedirs(path, exist_ok=True)
-            with open(os.path.join(path, sha[2:]), "wb") as f:
-                f.write(zlib.compress(store))
+    def __init__(self, pack_path: str):
+        self.path = pack_path
+        self.index = PackIndex(pack_path[:-len(".pack")] + ".idx")
+        with open(pack_path, "rb") as f:
+            self.data = memoryview(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+
+    def find(self, sha: bytes) -> int | None:
+        return self.index.find(sha)
+
+    def entry(self, offset: int) -> Tuple[str, int, str | int | None, memoryview]:
+        """
+        Parse the entry at offset. Returns its type, inflated size, base and a
+        zero-copy view of the pack starting at its compressed data.
+        """
+        obj_type, size, base, data_offset = read_entry_header(self.data, offset)
+        return obj_type, size, base, self.data[data_offset:]
+
+
+# Opened packs, keyed by .pack path
+_packs: Dict[str, PackFile] = {}
+
+
+def load_pack(pack_path: str) -> PackFile:
+    """Map a pack and its index into memory, once per process."""
+    if pack_path not in _packs:
+        _packs[pack_path] = PackFile(pack_path)
+    return _packs[pack_path]
+
+
+class LRUCache:
+    """Byte-bounded LRU cache of (type, content) objects with hit and miss counters."""
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict[Hashable, Tuple[str, bytes]] = OrderedDict()
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._entries
+
+    def get(self, key: Hashable) -> Tuple[str, bytes] | None:
+        """Return the cached (type, content) for key, marking it most recently used."""
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry
+
+    def put(self, key: Hashable, obj_type: str, content: bytes) -> None:
+        """Cache an object, evicting least recently used entries over the limit."""
+        if len(content) > self.limit:
+            return
+        if key in self._entries:
+            self.size -= len(self._entries.pop(key)[1])
+        self._entries[key] = (obj_type, content)
+        self.size += len(content)
+
+        while self.size > self.limit:
+            _, (_, evicted) = self._entries.popitem(last=False)
+            self.size -= len(evicted)
 
-            processed_objects.add(sha)
-            return sha
 
+# Resolved delta bases keyed by (pack path, offset), in the spirit of git's core.deltaBaseCacheLimit
+delta_base_cache = LRUCache(DELTA_BASE_CACHE_LIMIT)
+
+
+class ObjectCache:
+    """
+    Process-wide LRU cache of whole objects keyed by binary SHA. Blobs have their
+    own budget so large files cannot push out the trees and commits that are
+    read over and over while walking history.
+    """
+
+    def __init__(self, tree_limit: int = OBJECT_CACHE_TREE_LIMIT, blob_limit: int = OBJECT_CACHE_BLOB_LIMIT):
+        self.trees = LRUCache(tree_limit)  # trees, commits and tags
+        self.blobs = LRUCache(blob_limit)
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, sha: bytes) -> Tuple[str, bytes] | None:
+        for pool in [self.trees, self.blobs]:
+            if sha in pool:
+                self.hits += 1
+                return pool.get(sha)
+        self.misses += 1
+        return None
+
+    def put(self, sha: bytes, obj_type: str, content: bytes) -> None:
+        pool = self.blobs if obj_type == "blob" else self.trees
+        pool.put(sha, obj_type, content)
+
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+
+object_cache = ObjectCache()
+
+
+def read_pack_base(git_dir: str | None, pack_path: str, offset: int) -> Tuple[str, bytes]:
+    """Read a delta base from a pack through the delta base cache."""
+    key = (pack_path, offset)
+    base = delta_base_cache.get(key)
+    if base is None:
+        base = read_pack_entry(git_dir, pack_path, offset)
+        delta_base_cache.put(key, *base)
+    return base
+
+
+def read_pack_entry(git_dir: str | None, pack_path: str, offset: int) -> Tuple[str, bytes]:
+    """
+    Read the pack entry at offset, resolving deltas, and return its type and content.
+    ref_delta bases outside the pack are looked up in the object store of git_dir,
+    and are an error for a pack outside any repository (git_dir None).
+    """
+    pack = load_pack(pack_path)
+    obj_type, size, base, data = pack.entry(offset)
+
+    if obj_type == "ref_delta":
+        base_offset = pack.find(bytes.fromhex(base))
+        if base_offset is not None:
+            base_type, base_content = read_pack_base(git_dir, pack_path, base_offset)
+        elif git_dir is not None:
+            base_type, base_content = open_store(git_dir).read(base)
+        else:
+            raise RuntimeError(f"Delta at offset {offset} has base {base} outside {pack_path}")
+        delta, _ = inflate_at(data, 0, size)
+        return base_type, apply_delta(base_content, delta)
+
+    if obj_type == "ofs_delta":
+        base_type, base_content = read_pack_base(git_dir, pack_path, base)
+        delta, _ = inflate_at(data, 0, size)
+        return base_type, apply_delta(base_content, delta)
+
+    content, _ = inflate_at(data, 0, size)
+    return obj_type, content
+
+
+def read_pack_header(git_dir: str, pack_path: str, offset: int) -> Tuple[str, int]:
+    """
+    Return the type and size of the pack entry at offset from entry headers alone.
+    A delta inflates just the start of its data for the target size, and its type
+    is that of the base at the end of its chain.
+    """
+    pack = load_pack(pack_path)
+    obj_type, size, base, data = pack.entry(offset)
+    if base is None:
+        return obj_type, size
+
+    # The delta data starts with the base and target sizes
+    head = inflate_prefix(data, 0, 20)
+    _, pos = read_size(head, 0)
+    size, _ = read_size(head, pos)
+
+    while base is not None:
+        if obj_type == "ofs_delta":
+            offset = base
         else:
-            # Delta object
-            if base_sha not in processed_objects:
-                # Find and process base object first
-                for obj in objects:
-                    if obj[0] != "ref_delta" and hashlib.sha1(
-                            f"{obj[0]} {len(obj[1])}\x00".encode() + obj[1]).hexdigest() == base_sha:
-                        process_object(obj)
-                        break
-
-            # Read base object
-            with open(f"{git_dir}/objects/{base_sha[:2]}/{base_sha[2:]}", "rb") as f:
-                base_content = zlib.decompress(f.read())
-            base_type = base_content.split(b' ')[0].decode()
-            base_content = base_content.split(b'\x00', 1)[1]
-
-            # Skip size headers in delta
-            delta = content
-            _, delta = next_size(delta)  # base size
-            _, delta = next_size(delta)  # target size
-
-            # Apply delta instructions
-            result = b""
-            while delta:
-                cmd = delta[0]
-                if cmd & 0b10000000:  # Copy command
-                    pos = 1
-                    offset = 0
-                    size = 0
-
-                    # Read offset
-                    for i in range(4):
-                        if cmd & (1 << i):
-                            offset |= delta[pos] << (i * 8)
-                            pos += 1
-
-                    # Read size
-                    for i in range(3):
-                        if cmd & (1 << (4 + i)):
-                            size |= delta[pos] << (i * 8)
-                            pos += 1
-
-                    result += base_content[offset:offset + size]
-                    delta = delta[pos:]
-                else:  # Insert command
-                    size = cmd
-                    result += delta[1:size + 1]
-                    delta = delta[size + 1:]
-
-            # Store the resulting object
-            store = f"{base_type} {len(result)}\x00".encode() + result
-            sha = hashlib.sha1(store).hexdigest()
-
-            path = os.path.join(git_dir, "objects", sha[:2])
-            os.makedirs(path, exist_ok=True)
-            with open(os.path.join(path, sha[2:]), "wb") as f:
-                f.write(zlib.compress(store))
-
-            processed_objects.add(sha)
+            offset = pack.find(bytes.fromhex(base))
+            if offset is None:
+                return open_store(git_dir).read_header(base)[0], size
+        obj_type, _, base, _ = pack.entry(offset)
+    return obj_type, size
+
+
+def pack_git_dir(pack_path: str) -> str | None:
+    """Return the git directory a pack belongs to (.../objects/pack/x.pack -> ...), or None."""
+    pack_dir = os.path.dirname(os.path.abspath(pack_path))
+    objects_dir = os.path.dirname(pack_dir)
+    if os.path.basename(pack_dir) != "pack" or os.path.basename(objects_dir) != "objects":
+        return None
+    return os.path.dirname(objects_dir)
+
+
+def verify_pack(pack_path: str, verbose: bool = False) -> None:
+    """
+    Check a pack against its index like git verify-pack: the trailer checksums
+    of both, the object count, and the SHA and CRC32 of every object. With
+    verbose, list each object with its type, size, packed size, offset, delta
+    depth and base, followed by a histogram of delta chain lengths.
+    """
+    pack = load_pack(pack_path)
+    entries = parse_pack_entries(pack.data, keep_bases=False, keep_deltas=False)
+    if len(entries) != len(pack.index):
+        raise RuntimeError(f"Index lists {len(pack.index)} objects but the pack has {len(entries)}")
+
+    # The index ends with a copy of the pack checksum and a checksum of its own
+    index = pack.index
+    if hashlib.sha1(index.map[:-20]).digest() != index.map[-20:]:
+        raise RuntimeError("Index checksum mismatch")
+    if index.map[-40:-20] != pack.data[-20:]:
+        raise RuntimeError("Index was built for a different pack")
+
+    git_dir = pack_git_dir(pack_path)
+    sha_by_offset = {offset: sha for sha, offset in index.items()}
+    crc_by_offset = {index.offset_at(i): index.crc_at(i) for i in range(len(index))}
+    index_by_offset = {entry.offset: i for i, entry in enumerate(entries)}
+
+    def base_index(entry: PackEntry) -> int | None:
+        """Return the index of a delta's base, None for a ref_delta base outside the pack."""
+        if entry.obj_type == "ref_delta":
+            base_offset = pack.find(bytes.fromhex(entry.base))
+            if base_offset is None:
+                return None
+        else:
+            base_offset = entry.base
+        if base_offset not in index_by_offset:
+            raise RuntimeError(f"Delta at offset {entry.offset} has no base in the pack")
+        return index_by_offset[base_offset]
+
+    # Delta depth of every entry, walking each chain only up to the first known depth.
+    # A chain ending in a base outside the pack starts at depth 1, like one on a non-delta
+    depths: List[int | None] = [None] * len(entries)
+    for i in range(len(entries)):
+        chain, depth = [], 0
+        while depths[i] is None and entries[i].base is not None:
+            chain.append(i)
+            base = base_index(entries[i])
+            if base is None:
+                break
+            i = base
+        else:
+            depth = depths[i] or 0
+            depths[i] = depth
+        for j in reversed(chain):
+            depth += 1
+            depths[j] = depth
+
+    chain_lengths: Dict[int, int] = {}
+    for i, entry in enumerate(entries):
+        obj_type, content = read_pack_entry(git_dir, pack_path, entry.offset)
+        sha = sha_by_offset.get(entry.offset)
+        if hashlib.sha1(f"{obj_type} {len(content)}\x00".encode() + content).hexdigest() != sha:
+            raise RuntimeError(f"Object at offset {entry.offset} does not match its index entry {sha}")
+        if entry.crc != crc_by_offset[entry.offset]:
+            raise RuntimeError(f"CRC32 mismatch for object {sha} at offset {entry.offset}")
+
+        chain_lengths[depths[i]] = chain_lengths.get(depths[i], 0) + 1
+        if verbose:
+            end = entries[i + 1].offset if i + 1 < len(entries) else len(pack.data) - 20
+            line = f"{sha} {obj_type:<6} {entry.size} {end - entry.offset} {entry.offset}"
+            if entry.base is not None:
+                base = base_index(entry)
+                base_sha = entry.base if base is None else sha_by_offset[entries[base].offset]
+                line += f" {depths[i]} {base_sha}"
+            print(line)
+
+    if verbose:
+        for depth, count in sorted(chain_lengths.items()):
+            label = "non delta" if depth == 0 else f"chain length = {depth}"
+            print(f"{label}: {count} {'object' if count == 1 else 'objects'}")
+        print(f"{pack_path}: ok")
+
+
+def sync_filesystem(path: str) -> None:
+    """
+    Flush the filesystem holding path to disk. Git's batch mode starts writeback
+    of each object with sync_file_range and then issues one fsync, but Python
+    has no sync_file_range, so the whole filesystem is flushed with syncfs(2)
+    instead. That still waits for unrelated dirty data on the same filesystem,
+    though not on others. Where libc has no syncfs, every filesystem on the host
+    is flushed with os.sync().
+    """
+    syncfs = getattr(ctypes.CDLL(None, use_errno=True), "syncfs", None)
+    if syncfs is None:
+        os.sync()
+        return
+
+    fd = os.open(path, os.O_RDONLY | os.O_DIRECTORY)
+    try:
+        if syncfs(fd) != 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno), path)
+    finally:
+        os.close(fd)
+
+
+class LooseObjectBackend:
+    """Objects stored one per zlib-compressed file under objects/xx/."""
+
+    def __init__(self, objects_dir: str):
+        self.objects_dir = objects_dir
+        # Names in each fanout directory, listed on first use and kept up to date by writes
+        self.listings: Dict[str, set] = {}
+        # Directory fds, temporary file names and SHAs of objects waiting for the current batch
+        self.batch: List[Tuple[int, str, str]] | None = None
+        # Descriptors of objects/ and its 256 fanout directories, opened on the first write
+        self.root_fd: int | None = None
+        self.fanout_fds: List[int] = []
+        self.fds_lock = threading.Lock()
+        self.tmp_ids = itertools.count()
+
+    def path(self, sha: str) -> str:
+        return os.path.join(self.objects_dir, sha[:2], sha[2:])
+
+    def open_directories(self) -> None:
+        """
+        Create and open the 256 fanout directories together, once, so writes
+        never create directories or resolve paths from the objects directory.
+        """
+        with self.fds_lock:
+            if self.fanout_fds:
+                return
+            flags = os.O_RDONLY | os.O_DIRECTORY
+            root_fd = os.open(self.objects_dir, flags)
+            fds = []
+            for prefix in range(256):
+                name = f"{prefix:02x}"
+                try:
+                    os.mkdir(name, dir_fd=root_fd)
+                except FileExistsError:
+                    pass
+                fds.append(os.open(name, flags, dir_fd=root_fd))
+            self.root_fd, self.fanout_fds = root_fd, fds
+
+    def fanout_fd(self, sha: str) -> int:
+        """Return a descriptor of the fanout directory of an object."""
+        if not self.fanout_fds:
+            self.open_directories()
+        return self.fanout_fds[int(sha[:2], 16)]
+
+    def close(self) -> None:
+        """Close the directory descriptors. They are opened again by the next write."""
+        with self.fds_lock:
+            for fd in self.fanout_fds + ([self.root_fd] if self.root_fd is not None else []):
+                os.close(fd)
+            self.root_fd, self.fanout_fds = None, []
+
+    def create_temp(self, dir_fd: int) -> Tuple[int, str]:
+        """Create a read-only temporary object file in a directory, returning its fd and name."""
+        while True:
+            name = f"tmp_obj_{os.getpid()}_{next(self.tmp_ids)}"
+            try:
+                return os.open(name, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o444, dir_fd=dir_fd), name
+            except FileExistsError:
+                # Left behind by an earlier process with the same pid
+                continue
+
+    def listed(self, sha: str) -> bool:
+        """
+        Check for an object in the cached listing of its fanout directory,
+        which costs one listdir per directory instead of a stat per object.
+        Objects written by other processes since the listing was taken are
+        missed, which only means they get written again.
+        """
+        names = self.listings.get(sha[:2])
+        if names is None:
+            names = set(os.listdir(self.fanout_fd(sha)))
+            self.listings[sha[:2]] = names
+        return sha[2:] in names
+
+    def read(self, sha: str) -> Tuple[str, bytes] | None:
+        try:
+            with open(self.path(sha), "rb") as f:
+                data = zlib.decompress(f.read())
+        except FileNotFoundError:
+            return None
+
+        # Split into header and content
+        null_pos = data.index(b'\x00')
+        header = data[:null_pos]
+        content = data[null_pos + 1:]
+
+        # Parse type and size from header
+        obj_type = header.split(b' ')[0].decode()
+        return obj_type, content
+
+    def read_stream(self, sha: str) -> Tuple[str, int, Iterator[bytes]] | None:
+        try:
+            f = open(self.path(sha), "rb")
+        except FileNotFoundError:
+            return None
+
+        # Inflate until the header is complete, the rest is produced on demand
+        chunks = inflate_chunks(f.read)
+        head = b""
+        for chunk in chunks:
+            head += chunk
+            if b'\x00' in head:
+                break
+        header, first = head.split(b'\x00', 1)
+        obj_type, size = header.decode().split(" ")
+
+        def content() -> Iterator[bytes]:
+            with f:
+                if first:
+                    yield first
+                yield from chunks
+
+        return obj_type, int(size), content()
+
+    def read_header(self, sha: str) -> Tuple[str, int] | None:
+        try:
+            with open(self.path(sha), "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                # "<type> <size>\0" fits in the first few dozen inflated bytes
+                header = inflate_prefix(data, 0, 64)
+        except FileNotFoundError:
+            return None
+
+        obj_type, size = header[:header.index(b'\x00')].decode().split(" ")
+        return obj_type, int(size)
+
+    def exists(self, sha: str) -> bool:
+        return os.path.exists(self.path(sha))
+
+    def write(self, data: bytes, obj_type: str) -> str:
+        # Prepare the object store data with header
+        store = f"{obj_type} {len(data)}\x00".encode() + data
+
+        # Calculate SHA1 hash
+        sha = hashlib.sha1(store).hexdigest()
+
+        # Objects are content-addressed, so one that exists never needs compressing again
+        if self.listed(sha):
+            return sha
+
+        self.write_compressed(sha, zlib.compress(store))
+        return sha
+
+    def write_compressed(self, sha: str, compressed: bytes) -> None:
+        """
+        Store an object that is already compressed, never leaving a partial file
+        at its final path. The temporary file goes next to it, like git, so no
+        single directory fills up.
+        """
+        dir_fd = self.fanout_fd(sha)
+        fd, tmp_name = self.create_temp(dir_fd)
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(compressed)
+            self.install(dir_fd, tmp_name, sha)
+        except BaseException:
+            os.unlink(tmp_name, dir_fd=dir_fd)
+            raise
+
+    def write_file(self, path: str, obj_type: str = "blob") -> str:
+        """
+        Hash and store a file in fixed-size chunks, so memory use stays constant
+        whatever its size. The header comes from stat. The file is hashed and
+        compressed in one pass into a temporary file under objects/, which is
+        renamed into place, or dropped if the object turns out to exist already.
+        """
+        size = os.stat(path).st_size
+        header = f"{obj_type} {size}\x00".encode()
+        sha = hashlib.sha1(header)
+        compressor = zlib.compressobj()
+
+        if not self.fanout_fds:
+            self.open_directories()
+        dir_fd = self.root_fd
+        fd, tmp_name = self.create_temp(dir_fd)
+        try:
+            with os.fdopen(fd, "wb") as out, open(path, "rb") as f:
+                out.write(compressor.compress(header))
+                hashed = 0
+                while chunk := f.read(STREAM_CHUNK_SIZE):
+                    sha.update(chunk)
+                    out.write(compressor.compress(chunk))
+                    hashed += len(chunk)
+                out.write(compressor.flush())
+
+            if hashed != size:
+                raise RuntimeError(f"{path} changed while it was being hashed")
+
+            sha = sha.hexdigest()
+            exists = self.listed(sha)
+            if not exists:
+                self.install(dir_fd, tmp_name, sha)
+        except BaseException:
+            os.unlink(tmp_name, dir_fd=dir_fd)
+            raise
+
+        if exists:
+            # Already stored, so the new copy is not needed
+            os.unlink(tmp_name, dir_fd=dir_fd)
+        return sha
+
+    def install(self, dir_fd: int, tmp_name: str, sha: str) -> None:
+        """
+        Rename a complete temporary object file into place, or queue it until
+        the current batch is flushed.
+        """
+        if not self.listed(sha):
+            self.listings[sha[:2]].add(sha[2:])
+        if self.batch is not None:
+            self.batch.append((dir_fd, tmp_name, sha))
+            return
+        os.replace(tmp_name, sha[2:], src_dir_fd=dir_fd, dst_dir_fd=self.fanout_fd(sha))
+
+    def flush(self) -> None:
+        """
+        End the current batch: one sync makes every queued object durable, and
+        only then are they renamed into place, so a crash never leaves a
+        truncated object behind a valid name.
+        """
+        pending, self.batch = self.batch, None
+        if pending:
+            sync_filesystem(self.objects_dir)
+        for dir_fd, tmp_name, sha in pending or []:
+            self.install(dir_fd, tmp_name, sha)
+
+
+class PackedObjectBackend:
+    """Objects stored in the packs under objects/pack. Read-only."""
+
+    def __init__(self, git_dir: str):
+        self.git_dir = git_dir
+        self.pack_dir = os.path.join(git_dir, "objects", "pack")
+        self.packs: List[str] = []
+        self.scanned = None  # pack directory mtime when packs was listed
+
+    def find(self, sha: str) -> Tuple[str, int] | None:
+        """Return the pack path and offset of an object."""
+        # Pick up packs written since the last lookup. Packs are found through
+        # their .idx, like git, since a .pack is renamed into place before it
+        try:
+            mtime = os.stat(self.pack_dir).st_mtime_ns
+        except FileNotFoundError:
+            return None
+        if mtime != self.scanned:
+            self.packs = sorted(os.path.join(self.pack_dir, name[:-len(".idx")] + ".pack")
+                                for name in os.listdir(self.pack_dir) if name.endswith(".idx"))
+            self.scanned = mtime
+
+        binary_sha = bytes.fromhex(sha)
+        for pack_path in self.packs:
+            try:
+                pack = load_pack(pack_path)
+            except (OSError, ValueError, RuntimeError, struct.error):
+                # Half removed by a repack, or otherwise unusable: skip it like git
+                continue
+            offset = pack.find(binary_sha)
+            if offset is not None:
+                return pack_path, offset
+        return None
+
+    def read(self, sha: str) -> Tuple[str, bytes] | None:
+        found = self.find(sha)
+        return None if found is None else read_pack_entry(self.git_dir, *found)
+
+    def read_stream(self, sha: str) -> Tuple[str, int, Iterator[bytes]] | None:
+        found = self.find(sha)
+        if found is None:
+            return None
+
+        obj_type, size, base, data = load_pack(found[0]).entry(found[1])
+        if base is not None:
+            # A delta needs its whole base anyway
+            obj_type, content = read_pack_entry(self.git_dir, *found)
+            return obj_type, len(content), iter([content])
+
+        pos = 0
+
+        def read(n: int) -> memoryview:
+            nonlocal pos
+            chunk = data[pos:pos + n]
+            pos += len(chunk)
+            return chunk
+
+        return obj_type, size, inflate_chunks(read)
+
+    def read_header(self, sha: str) -> Tuple[str, int] | None:
+        found = self.find(sha)
+        return None if found is None else read_pack_header(self.git_dir, *found)
+
+    def exists(self, sha: str) -> bool:
+        return self.find(sha) is not None
+
+
+class ObjectWriter:
+    """
+    Background pipeline for loose object writes. write() hashes an object and
+    returns its SHA straight away, while compressor threads deflate queued
+    objects and a writer thread stores them, so hashing, compression and disk
+    I/O overlap. Queued objects are capped at limit bytes, and producers block
+    when the pipeline falls behind. Errors are raised by close().
+    """
+
+    def __init__(self, loose: LooseObjectBackend, compressors: int = WRITER_COMPRESSORS,
+                 limit: int = WRITER_MEMORY_LIMIT):
+        self.loose = loose
+        self.limit = limit
+        self.pending = 0  # bytes of objects accepted but not yet written
+        self.budget = threading.Condition()
+        self.error: BaseException | None = None
+        self.to_compress: queue.SimpleQueue = queue.SimpleQueue()
+        self.to_write: queue.SimpleQueue = queue.SimpleQueue()
+
+        self.compressors = [threading.Thread(target=self.compress_loop, daemon=True) for _ in range(compressors)]
+        self.writer = threading.Thread(target=self.write_loop, daemon=True)
+        for thread in self.compressors + [self.writer]:
+            thread.start()
+
+    def write(self, data: bytes, obj_type: str) -> str:
+        """Queue an object for writing and return its SHA1 hash."""
+        if self.error is not None:
+            raise self.error
+
+        store = f"{obj_type} {len(data)}\x00".encode() + data
+        sha = hashlib.sha1(store).hexdigest()
+        if self.loose.listed(sha):
             return sha
+        # Claim the name now, so copies queued before it is written are skipped
+        self.loose.listings[sha[:2]].add(sha[2:])
+
+        with self.budget:
+            # An object bigger than the whole budget waits for an empty pipeline
+            self.budget.wait_for(lambda: self.pending == 0 or self.pending + len(store) <= self.limit)
+            self.pending += len(store)
+        self.to_compress.put((sha, store))
+        return sha
+
+    def compress_loop(self) -> None:
+        while (item := self.to_compress.get()) is not None:
+            sha, store = item
+            try:
+                compressed = zlib.compress(store)
+            except BaseException as e:
+                self.fail(sha, e)
+                self.release(len(store))
+            else:
+                self.to_write.put((sha, compressed, len(store)))
+
+    def write_loop(self) -> None:
+        while (item := self.to_write.get()) is not None:
+            sha, compressed, size = item
+            try:
+                self.loose.write_compressed(sha, compressed)
+            except BaseException as e:
+                self.fail(sha, e)
+            finally:
+                self.release(size)
+
+    def fail(self, sha: str, error: BaseException) -> None:
+        """Record an object that could not be stored, so close() raises and it can be written again."""
+        self.loose.listings[sha[:2]].discard(sha[2:])
+        self.error = self.error or error
+
+    def release(self, size: int) -> None:
+        """Return the budget of an object that has left the pipeline."""
+        with self.budget:
+            self.pending -= size
+            self.budget.notify_all()
+
+    def close(self) -> None:
+        """Wait for every queued object to be written."""
+        for _ in self.compressors:
+            self.to_compress.put(None)
+        for thread in self.compressors:
+            thread.join()
+        self.to_write.put(None)
+        self.writer.join()
+        if self.error is not None:
+            raise self.error
+
+
+class ObjectStore:
+    """
+    Git objects of one repository, looked up in loose objects first and then
+    in packs. New objects are written loose.
+    """
 
-    for obj in objects:
-        process_object(obj)
+    def __init__(self, git_dir: str = ".git"):
+        self.loose = LooseObjectBackend(os.path.join(git_dir, "objects"))
+        self.packed = PackedObjectBackend(git_dir)
+        self.backends = [self.loose, self.packed]
+        self.writer: ObjectWriter | None = None
+
+    def read(self, sha: str) -> Tuple[str, bytes]:
+        """Return the type and content of an object."""
+        binary_sha = bytes.fromhex(sha)
+        obj = object_cache.get(binary_sha)
+        if obj is not None:
+            return obj
+
+        for backend in self.backends:
+            obj = backend.read(sha)
+            if obj is not None:
+                object_cache.put(binary_sha, *obj)
+                return obj
+        raise RuntimeError(f"Object not found: {sha}")
+
+    def read_stream(self, sha: str) -> Tuple[str, int, Iterator[bytes]]:
+        """Return the type and size of an object, and its content as an iterator of chunks."""
+        obj = object_cache.get(bytes.fromhex(sha))
+        if obj is not None:
+            return obj[0], len(obj[1]), iter([obj[1]])
+
+        for backend in self.backends:
+            stream = backend.read_stream(sha)
+            if stream is not None:
+                return stream
+        raise RuntimeError(f"Object not found: {sha}")
+
+    def read_header(self, sha: str) -> Tuple[str, int]:
+        """Return the type and size of an object."""
+        for backend in self.backends:
+            header = backend.read_header(sha)
+            if header is not None:
+                return header
+        raise RuntimeError(f"Object not found: {sha}")
+
+    def exists(self, sha: str) -> bool:
+        return any(backend.exists(sha) for backend in self.backends)
+
+    def write(self, data: bytes, obj_type: str) -> str:
+        """Store an object and return its SHA1 hash."""
+        if self.writer is not None:
+            return self.writer.write(data, obj_type)
+        return self.loose.write(data, obj_type)
+
+    def write_file(self, path: str, obj_type: str = "blob") -> str:
+        """Store a file as an object without reading it into memory, returning its SHA1 hash."""
+        return self.loose.write_file(path, obj_type)
+
+    def close(self) -> None:
+        """Release the descriptors held for writing. Not to be called inside a batch."""
+        self.loose.close()
+
+    @contextmanager
+    def bulk_checkin(self):
+        """
+        Batch object writes like core.fsyncMethod=batch: objects written inside
+        the block stay in temporary files, and on exit a single sync covers
+        them all before they are renamed into place. They cannot be read back
+        until the block ends. Nested blocks join the outer batch.
+        """
+        if self.loose.batch is not None:
+            yield self
+            return
+
+        self.loose.batch = []
+        try:
+            yield self
+        finally:
+            self.loose.flush()
+
+    @contextmanager
+    def background_writes(self, compressors: int = WRITER_COMPRESSORS, limit: int = WRITER_MEMORY_LIMIT):
+        """
+        Send object writes inside the block through an ObjectWriter, so write()
+        returns as soon as the SHA is known. Like a bulk checkin, the objects
+        cannot be read back until the block ends and the writer has drained.
+        """
+        if self.writer is not None:
+            yield self
+            return
+
+        self.writer = ObjectWriter(self.loose, compressors, limit)
+        try:
+            yield self
+        finally:
+            writer, self.writer = self.writer, None
+            writer.close()
+
+
+# Object stores by git directory, so pack listings and mappings are reused
+_stores: Dict[str, ObjectStore] = {}
+
+
+def open_store(git_dir: str = ".git") -> ObjectStore:
+    """Return the object store of a git directory."""
+    if git_dir not in _stores:
+        _stores[git_dir] = ObjectStore(git_dir)
+    return _stores[git_dir]
+
+
+def close_stores() -> None:
+    """Close and forget every object store opened by open_store."""
+    for store in _stores.values():
+        store.close()
+    _stores.clear()
 
 
 def read_object(path: str, sha: str) -> Tuple[str, bytes]:
     """Read a Git object and return its type and content."""
-    with open(f"{path}/.git/objects/{sha[:2]}/{sha[2:]}", "rb") as f:
-        data = zlib.decompress(f.read())
+    return open_store(os.path.join(path, ".git")).read(sha)
 
-    # Split into header and content
-    null_pos = data.index(b'\x00')
-    header = data[:null_pos]
-    content = data[null_pos + 1:]
 
-    # Parse type and size from header
-    obj_type = header.split(b' ')[0].decode()
-    return obj_type, content
+def cat_file_batch(store: ObjectStore, contents: bool) -> None:
+    """
+    Answer object requests read from stdin, one SHA per line, until EOF, like
+    git cat-file --batch (with contents) and --batch-check (without).
+    Each answer is "<sha> <type> <size>" followed by the content, or "<sha> missing".
+    """
+    out = sys.stdout.buffer
+    for line in sys.stdin.buffer:
+        sha = line.strip().decode()
+        try:
+            if contents:
+                obj_type, size, chunks = store.read_stream(sha)
+            else:
+                obj_type, size = store.read_header(sha)
+        except (RuntimeError, ValueError):
+            out.write(f"{sha} missing\n".encode())
+        else:
+            out.write(f"{sha} {obj_type} {size}\n".encode())
+            if contents:
+                for chunk in chunks:
+                    out.write(chunk)
+                out.write(b"\n")
+
+        # Flush every answer so a caller on the other end of a pipe can wait for it
+        out.flush()
 
 
 def render_tree(repo_path: str, dir_path: str, sha: str):
@@ -403,58 +1864,72 @@ def main():
 
     elif command == "cat-file":
         sub_command = sys.argv[2]
-        sha = sys.argv[3]
-        with open(f".git/objects/{sha[:2]}/{sha[2:]}", "rb") as f:
-            data = zlib.decompress(f.read())
+        if sub_command in ["--batch", "--batch-check"]:
+            cat_file_batch(open_store(), contents=sub_command == "--batch")
+            return
 
-            parts = data.split(b"\x00", 2)
-            _type, _size = parts[0].decode().split(" ")
-            _content = parts[-1].decode()
-
-            if sub_command == "-p":
-                print(_content, end="")
-
-    elif command == "hash-object":
-        if sys.argv[2] == "-w":
-            if sys.argv[3] == "--stdin":
-                data = sys.stdin.buffer.read()
+        sha = sys.argv[3]
+        if sub_command in ["-t", "-s"]:
+            # Only the header is needed, so the object is never fully inflated
+            _type, _size = open_store().read_header(sha)
+            print(_type if sub_command == "-t" else _size)
+            return
+
+        if sub_command == "-p":
+            _type, _size, _chunks = open_store().read_stream(sha)
+            if _type == "blob":
+                # Blobs may be large or binary, so they are streamed out as raw bytes
+                for chunk in _chunks:
+                    sys.stdout.buffer.write(chunk)
             else:
-                with open(sys.argv[3], "rb") as f:
-                    data = f.read()
+                print(b"".join(_chunks).decode(), end="")
 
-            print(hash_object(data, "blob"))
+    elif command == "hash-object":
+        options, paths = parse_hash_object_options(sys.argv[2:])
+        write = options["write"]
+
+        if options["stdin_paths"]:
+            # One path per line, each answered in order as soon as it is hashed
+            paths = (line.rstrip("\n") for line in sys.stdin if line.strip())
+            with open_store().bulk_checkin():
+                for sha in hash_paths(paths, write=write, threads=options["threads"]):
+                    print(sha, flush=True)
+        else:
+            if options["stdin"]:
+                print(hash_object(sys.stdin.buffer.read(), "blob", write=write))
+            # Files are streamed when written, so memory use does not depend on their size
+            for path in paths:
+                print(hash_file(path, write=write))
 
     elif command == "ls-tree":
         if sys.argv[2] == "--name-only":
             sha = sys.argv[3]
-            with open(f".git/objects/{sha[:2]}/{sha[2:]}", "rb") as f:
-                data = zlib.decompress(f.read())
-
-                header_end = data.index(b'\x00')
-                content = data[header_end + 1:]
+            _, content = open_store().read(sha)
 
-                pos = 0
-                entries = []
-                while pos < len(content):
-                    # Find the end of the mode+name portion (marked by null byte)
-                    null_pos = content.index(b'\x00', pos)
+            pos = 0
+            entries = []
+            while pos < len(content):
+                # Find the end of the mode+name portion (marked by null byte)
+                null_pos = content.index(b'\x00', pos)
 
-                    # Extract mode and name
-                    mode_name = content[pos:null_pos]
-                    mode, name = mode_name.split(b' ', 1)
+                # Extract mode and name
+                mode_name = content[pos:null_pos]
+                mode, name = mode_name.split(b' ', 1)
 
-                    # Skip past the SHA (20 bytes) and prepare for next entry
-                    pos = null_pos + 1 + 20
+                # Skip past the SHA (20 bytes) and prepare for next entry
+                pos = null_pos + 1 + 20
 
-                    entries.append(name.decode())
+                entries.append(name.decode())
 
-                # Print entries (they're already sorted in the tree object)
-                for entry in entries:
-                    print(entry)
+            # Print entries (they're already sorted in the tree object)
+            for entry in entries:
+                print(entry)
 
     elif command == "write-tree":
         # Write tree starting from current directory
-        tree_sha = write_tree_recursive(".")
+        store = open_store()
+        with store.bulk_checkin(), store.background_writes():
+            tree_sha = write_tree_recursive(".")
         print(tree_sha)
 
     elif command == "commit-tree":
@@ -474,11 +1949,46 @@ def main():
         commit_sha = create_commit(tree_sha, parent_sha, message)
         print(commit_sha)
 
+    elif command == "index-pack":
+        options, args = parse_pack_options(sys.argv[2:])
+        options["keep_pack"] = True
+        if len(args) != 1:
+            raise RuntimeError("usage: index-pack [--threads N] [--processes N] [--max-memory SIZE] "
+                               "(<pack-file> | --stdin)")
+        # Packs are only ever written into an existing repository, never a new one under cwd
+        if not os.path.isdir(".git/objects"):
+            raise RuntimeError("index-pack: not a git repository (no .git/objects)")
+
+        if args == ["--stdin"]:
+            if options["max_memory"] is None:
+                pack_sha = write_packfile(sys.stdin.buffer.read(), ".", **options)
+            else:
+                # Spool stdin to disk and map it instead of holding it in memory
+                with tempfile.NamedTemporaryFile(prefix="tmp_pack_", dir=".git/objects") as f:
+                    shutil.copyfileobj(sys.stdin.buffer, f)
+                    f.flush()
+                    with map_file(f) as packfile:
+                        pack_sha = write_packfile(packfile, ".", pack_path=f.name, **options)
+        else:
+            with open(args[0], "rb") as f:
+                with map_file(f) as packfile:
+                    pack_sha = write_packfile(packfile, ".", pack_path=args[0], **options)
+
+        print(pack_sha)
+
+    elif command == "verify-pack":
+        verbose = "-v" in sys.argv[2:]
+        for path in sys.argv[2:]:
+            if path != "-v":
+                verify_pack(path[:-len(".idx")] + ".pack" if path.endswith(".idx") else path, verbose)
+
     elif command == "clone":
-        # Get repository URL and directory
-        remote = sys.argv[2]
-        if len(sys.argv) == 4:
-            local = sys.argv[3]
+        # Get options, repository URL and directory
+        options, args = parse_pack_options(sys.argv[2:])
+
+        remote = args[0]
+        if len(args) == 2:
+            local = args[1]
         else:
             parsed = urlparse(remote)
             local = parsed.path.split("/")[-1].replace(".git", "")
@@ -505,8 +2015,18 @@ def main():
 
         # Download and process packfile
         print(f"Downloading {default_branch} ({default_ref_sha})")
-        packfile = download_packfile(remote, default_ref_sha)
-        write_packfile(packfile, local)
+        store = open_store(os.path.join(local, ".git"))
+        with store.bulk_checkin(), store.background_writes():
+            if options["max_memory"] is None:
+                packfile = download_packfile(remote, default_ref_sha)
+                write_packfile(packfile, local, **options)
+            else:
+                # Spool the pack to disk and map it instead of holding it in memory
+                with tempfile.NamedTemporaryFile(prefix="tmp_pack_", dir=os.path.join(local, ".git", "objects")) as f:
+                    stream_packfile(remote, default_ref_sha, f)
+                    f.flush()
+                    with map_file(f) as packfile:
+                        write_packfile(packfile, local, pack_path=f.name, **options)
 
         # Write HEAD ref
         with open(os.path.join(local, ".git", "HEAD"), "w") as f:
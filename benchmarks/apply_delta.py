@@ -0,0 +1,59 @@
+"""
+Microbenchmark for apply_delta.
+
+Run from the repository root:
+
+    python -m benchmarks.apply_delta [base size in MB]
+"""
+import os
+import sys
+import timeit
+from typing import Tuple
+
+from app.main import apply_delta
+
+
+def encode_size(size: int) -> bytes:
+    """Encode a delta header size field."""
+    out = bytearray()
+    while True:
+        byte = size & 0b01111111
+        size >>= 7
+        if size:
+            out.append(byte | 0b10000000)
+        else:
+            out.append(byte)
+            return bytes(out)
+
+
+def make_delta(base: bytes, copy_size: int = 4096, insert_size: int = 16) -> Tuple[bytes, int]:
+    """
+    Build a delta that alternates copies of the base with small inserts,
+    like a file that was edited every few kilobytes.
+    Returns the delta and its target size.
+    """
+    ops = []
+    target_size = 0
+    for offset in range(0, len(base) - copy_size, copy_size):
+        # Copy command with 4 offset bytes and 2 size bytes
+        ops.append(bytes([0b10110000 | 0b1111]) + offset.to_bytes(4, "little") + copy_size.to_bytes(2, "little"))
+        ops.append(bytes([insert_size]) + os.urandom(insert_size))
+        target_size += copy_size + insert_size
+
+    delta = encode_size(len(base)) + encode_size(target_size) + b"".join(ops)
+    return delta, target_size
+
+
+def main():
+    base_mb = int(sys.argv[1]) if len(sys.argv) > 1 else 16
+    base = os.urandom(base_mb << 20)
+    delta, target_size = make_delta(base)
+
+    runs = 5
+    elapsed = min(timeit.repeat(lambda: apply_delta(base, delta), number=1, repeat=runs))
+    print(f"apply_delta: {base_mb} MB base, {len(delta)} byte delta -> {target_size} bytes")
+    print(f"best of {runs}: {elapsed * 1000:.1f} ms ({target_size / elapsed / (1 << 20):.0f} MB/s)")
+
+
+if __name__ == "__main__":
+    main()
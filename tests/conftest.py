@@ -0,0 +1,10 @@
+import pytest
+
+from app.main import close_stores
+
+
+@pytest.fixture(autouse=True)
+def fresh_stores():
+    """Give every test its own object stores, and release their descriptors afterwards."""
+    yield
+    close_stores()
@@ -0,0 +1,37 @@
+import shutil
+import subprocess
+import threading
+
+import pytest
+
+from app.main import hash_file, hash_paths
+
+
+@pytest.mark.skipif(shutil.which("git") is None, reason="git is not installed")
+def test_hash_file_matches_git(tmp_path):
+    path = tmp_path / "data.bin"
+    path.write_bytes(bytes(range(256)) * 5000)
+    expected = subprocess.run(["git", "hash-object", str(path)], capture_output=True, text=True).stdout.strip()
+    assert hash_file(str(path), write=False) == expected
+
+
+def test_hash_paths_answers_before_the_next_path_arrives(tmp_path):
+    paths = []
+    for i in range(2):
+        paths.append(str(tmp_path / f"{i}.txt"))
+        (tmp_path / f"{i}.txt").write_text(f"file {i}\n")
+
+    released = threading.Event()
+    waited_out = []
+
+    def slow_paths():
+        # Like a pipeline that sends the next path only after reading an answer
+        yield paths[0]
+        waited_out.append(not released.wait(timeout=2))
+        yield paths[1]
+
+    hashes = hash_paths(slow_paths(), write=False, threads=2)
+    assert next(hashes) == hash_file(paths[0], write=False)
+    released.set()
+    assert list(hashes) == [hash_file(paths[1], write=False)]
+    assert waited_out == [False]
@@ -0,0 +1,115 @@
+import hashlib
+import os
+import struct
+import zlib
+
+import pytest
+
+from app.main import (ObjectStore, _packs, cat_file_batch, encode_type_size, hash_object, verify_pack,
+                      write_pack_index)
+
+
+@pytest.fixture
+def store(tmp_path):
+    os.makedirs(tmp_path / ".git" / "objects")
+    store = ObjectStore(str(tmp_path / ".git"))
+    yield store
+    store.close()
+
+
+def test_background_writer_reports_compression_errors(store, monkeypatch):
+    compress = zlib.compress
+
+    def failing(data, *args):
+        if data.endswith(b"lost"):
+            raise MemoryError("simulated")
+        return compress(data, *args)
+
+    monkeypatch.setattr(zlib, "compress", failing)
+    with pytest.raises(MemoryError):
+        # A budget this small makes every later write wait for the failed one
+        with store.background_writes(limit=16):
+            sha = store.write(b"lost", "blob")
+            for i in range(8):
+                store.write(b"kept %d" % i, "blob")
+
+    monkeypatch.setattr(zlib, "compress", compress)
+    assert not store.loose.listed(sha)
+    assert store.write(b"lost", "blob") == sha
+    assert store.read(sha) == ("blob", b"lost")
+
+
+def make_pack(objects):
+    """Build a pack of non-delta (type, content) objects, returning it and its (sha, offset, crc) entries."""
+    data, entries = b"PACK" + struct.pack("!II", 2, len(objects)), []
+    for obj_type, content in objects:
+        raw = encode_type_size(obj_type, len(content)) + zlib.compress(content)
+        entries.append((hash_object(content, obj_type, write=False), len(data), zlib.crc32(raw)))
+        data += raw
+    return data + hashlib.sha1(data).digest(), entries
+
+
+def test_packs_without_usable_index_are_skipped(store, monkeypatch, capsys):
+    pack_dir = store.packed.pack_dir
+    data, entries = make_pack([("blob", b"packed")])
+    pack_sha = write_pack_index(pack_dir, data, entries)
+    sha = entries[0][0]
+
+    # A pack still waiting for its index, an index whose pack is gone, and an empty index
+    orphan, orphan_entries = make_pack([("blob", b"orphan")])
+    orphan_sha = write_pack_index(pack_dir, orphan, orphan_entries)
+    os.rename(os.path.join(pack_dir, f"pack-{orphan_sha}.idx"), os.path.join(pack_dir, "lost.idx"))
+    os.rename(os.path.join(pack_dir, f"pack-{pack_sha}.idx"), os.path.join(pack_dir, "indexed.idx"))
+    os.rename(os.path.join(pack_dir, f"pack-{pack_sha}.pack"), os.path.join(pack_dir, "indexed.pack"))
+    open(os.path.join(pack_dir, "empty.idx"), "wb").close()
+
+    assert store.read(sha) == ("blob", b"packed")
+    missing = hash_object(b"orphan", "blob", write=False)
+    assert not store.exists(missing)
+
+    monkeypatch.setattr("sys.stdin", type("stdin", (), {"buffer": [f"{missing}\n".encode()]}))
+    cat_file_batch(store, contents=False)
+    assert capsys.readouterr().out == f"{missing} missing\n"
+
+
+@pytest.mark.parametrize("rehash", [False, True])
+def test_verify_pack_checks_index_crcs(tmp_path, rehash):
+    data, entries = make_pack([("blob", b"one"), ("blob", b"two")])
+    pack_sha = write_pack_index(str(tmp_path), data, entries)
+    pack_path = str(tmp_path / f"pack-{pack_sha}.pack")
+    idx_path = str(tmp_path / f"pack-{pack_sha}.idx")
+    verify_pack(pack_path)
+
+    # Flip a byte of the first CRC32, with and without fixing up the index checksum
+    with open(idx_path, "rb") as f:
+        idx = bytearray(f.read())
+    idx[8 + 256 * 4 + 20 * len(entries)] ^= 0xff
+    if rehash:
+        idx[-20:] = hashlib.sha1(idx[:-20]).digest()
+    os.chmod(idx_path, 0o644)
+    with open(idx_path, "wb") as f:
+        f.write(idx)
+
+    _packs.clear()
+    with pytest.raises(RuntimeError, match="CRC32 mismatch" if rehash else "Index checksum mismatch"):
+        verify_pack(pack_path)
+
+
+def test_verify_pack_resolves_bases_outside_the_pack(tmp_path, capsys):
+    # A thin pack holding one ref_delta against a blob that is only stored loose
+    git_dir = tmp_path / ".git"
+    os.makedirs(git_dir / "objects")
+    base_sha = hash_object(b"base", "blob", str(git_dir))
+    target = b"base and more"
+    delta = bytes([len(b"base"), len(target), 0b10010000, 4, len(b" and more")]) + b" and more"
+    raw = encode_type_size("ref_delta", len(delta)) + bytes.fromhex(base_sha) + zlib.compress(delta)
+    data = b"PACK" + struct.pack("!II", 2, 1)
+    entries = [(hash_object(target, "blob", write=False), len(data), zlib.crc32(raw))]
+    data += raw
+    data += hashlib.sha1(data).digest()
+    pack_sha = write_pack_index(str(git_dir / "objects" / "pack"), data, entries)
+
+    verify_pack(str(git_dir / "objects" / "pack" / f"pack-{pack_sha}.pack"), verbose=True)
+    lines = capsys.readouterr().out.splitlines()
+    assert lines[0] == f"{entries[0][0]} blob   {len(delta)} {len(raw)} 12 1 {base_sha}"
+    assert lines[1] == "chain length = 1: 1 object"
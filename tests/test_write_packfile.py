@@ -0,0 +1,77 @@
+import os
+import shutil
+import subprocess
+from contextlib import ExitStack
+
+import pytest
+
+from app.main import open_store, write_packfile
+
+pytestmark = pytest.mark.skipif(shutil.which("git") is None, reason="git is not installed")
+
+
+def git(*args: str, cwd: str) -> str:
+    env = dict(os.environ, GIT_AUTHOR_NAME="t", GIT_AUTHOR_EMAIL="t@t", GIT_COMMITTER_NAME="t",
+               GIT_COMMITTER_EMAIL="t@t")
+    return subprocess.run(["git", *args], cwd=cwd, env=env, check=True, capture_output=True, text=True).stdout
+
+
+@pytest.fixture(scope="module")
+def pack(tmp_path_factory):
+    """A pack with delta chains, and the SHAs of every object in it."""
+    src = str(tmp_path_factory.mktemp("src"))
+    git("init", "-q", cwd=src)
+    lines = [f"line {i}\n" for i in range(400)]
+    for revision in range(12):
+        lines[revision * 30] = f"changed in revision {revision}\n"
+        for name in ["a.txt", "b.txt"]:
+            with open(os.path.join(src, name), "w") as f:
+                f.write(name + "".join(lines))
+        git("add", "-A", cwd=src)
+        git("commit", "-q", "-m", f"revision {revision}", cwd=src)
+    git("repack", "-adfq", cwd=src)
+
+    pack_dir = os.path.join(src, ".git", "objects", "pack")
+    pack_path = next(os.path.join(pack_dir, name) for name in os.listdir(pack_dir) if name.endswith(".pack"))
+    shas = git("cat-file", "--batch-all-objects", "--batch-check=%(objectname)", cwd=src).split()
+    with open(pack_path, "rb") as f:
+        return f.read(), shas
+
+
+@pytest.mark.parametrize("contexts", [[], ["bulk_checkin"], ["background_writes"],
+                                      ["bulk_checkin", "background_writes"]])
+@pytest.mark.parametrize("processes", [1, 2])
+def test_ingest_writes_every_object(pack, tmp_path, contexts, processes):
+    data, shas = pack
+    target = str(tmp_path)
+    os.makedirs(os.path.join(target, ".git", "objects"))
+
+    # The same write contexts clone runs its ingest in
+    store = open_store(os.path.join(target, ".git"))
+    with ExitStack() as stack:
+        for context in contexts:
+            stack.enter_context(getattr(store, context)())
+        write_packfile(data, target, processes=processes)
+
+    objects_dir = os.path.join(target, ".git", "objects")
+    missing = [sha for sha in shas if not os.path.exists(os.path.join(objects_dir, sha[:2], sha[2:]))]
+    leftovers = [name for _, _, names in os.walk(objects_dir) for name in names if name.startswith("tmp_")]
+    assert missing == []
+    assert leftovers == []
+
+
+@pytest.mark.parametrize("processes", [1, 2])
+def test_bulk_checkin_defers_every_object(pack, tmp_path, processes):
+    data, shas = pack
+    target = str(tmp_path)
+    objects_dir = os.path.join(target, ".git", "objects")
+    os.makedirs(objects_dir)
+
+    def stored() -> int:
+        return sum(os.path.exists(os.path.join(objects_dir, sha[:2], sha[2:])) for sha in shas)
+
+    # Objects from worker processes wait for the batch like the parent's own
+    with open_store(os.path.join(target, ".git")).bulk_checkin():
+        write_packfile(data, target, processes=processes)
+        assert stored() == 0
+    assert stored() == len(shas)